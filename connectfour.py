@@ -25,10 +25,13 @@ along with connectfour.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import curses
+import os
 
 from src.board import Board
 from src.player import Player, RandomPlayer
-from src.basic_ai import AIPlayer
+from src.basic_ai import AIPlayer, heuristic
+from src.evaluation import PatternTableEvaluator
+from src.ponder import Ponderer
 
 # Symbols for players and empty
 SYMBOLS = {
@@ -126,16 +129,23 @@ def main(stdscr):
     curses.init_pair(COLOR_EMPTY, curses.COLOR_WHITE, curses.COLOR_BLACK)
 
     AI_DEPTH = 4
+    # Solve the game exactly once there are this many empty cells left
+    AI_TABLEBASE_EMPTY = 14
+
+    # Trained pattern table weights for the AI evaluation, if any
+    ai_weights = os.environ.get('CONNECTFOUR_AI_WEIGHTS')
+    evaluator = PatternTableEvaluator.load(ai_weights) if ai_weights else heuristic
 
     player_types = [
         lambda x: HumanPlayer(x, stdscr), 
-        lambda x: AIPlayer(x, AI_DEPTH)
+        lambda x: AIPlayer(x, AI_DEPTH, evaluator=evaluator, tablebase_empty=AI_TABLEBASE_EMPTY)
     ]
     random.shuffle(player_types)
 
     b = Board()
 
     players = {k: v(k) for k, v in zip([Board.P1, Board.P2], player_types)}
+    ponderers = {k: Ponderer(p) for k, p in players.items() if isinstance(p, AIPlayer)}
 
     while True:
         draw_board(stdscr, b)
@@ -151,6 +161,13 @@ def main(stdscr):
         player = players[b.curr_player]
         move = player.get_move(b)
         b.make_move(move)
+        # Search the AI's replies while a human chooses their move
+        for num, ponderer in ponderers.items():
+            if (num != b.curr_player and isinstance(players[b.curr_player], HumanPlayer)
+                    and b.check_for_victory() is None):
+                ponderer.start(b)
+            else:
+                ponderer.stop()
 
 
 if __name__ == "__main__":
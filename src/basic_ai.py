@@ -17,13 +17,21 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with connectfour.  If not, see <http://www.gnu.org/licenses/>.
 """
+import threading
+from collections import OrderedDict
+
 import numpy as np
 from src.board import Board
 from src.player import Player
+from src.tablebase import Tablebase, distance_to_win
+from src.evaluation import Evaluator
 
 
 WIN = 10000
 
+# Half width of the window searched around the previous iteration's score
+ASPIRATION_WINDOW = 50
+
 
 class Slots:
     '''A struct used in the heuristic function.'''
@@ -83,7 +91,7 @@ def heuristic(board: Board, player_number: int) -> int:
                             break 
                         if board.state[r, c] == player:
                             counts[Slots.PIECE] += 1
-                        elif r == 0 or board.state[r - 1, c] != board.EMPTY:
+                        elif r == board.NROW - 1 or board.state[r + 1, c] != board.EMPTY:
                             counts[Slots.GAP] += 1
                         else:
                             counts[Slots.VOID] += 1
@@ -101,7 +109,7 @@ def heuristic(board: Board, player_number: int) -> int:
     return value 
 
 
-def evaluate(board: Board, player_number: int) -> int:
+def evaluate(board: Board, player_number: int, evaluator: Evaluator = heuristic) -> int:
     victor = board.check_for_victory()
     if victor == board.EMPTY:
         return 0
@@ -110,7 +118,27 @@ def evaluate(board: Board, player_number: int) -> int:
     elif victor is not None:
         return -WIN 
     else:
-        return heuristic(board, player_number)
+        return evaluator(board, player_number)
+
+
+def evaluate_exact(board: Board, player_number: int, tablebase: Tablebase) -> int | None:
+    """
+    Look up the board in an endgame tablebase. Wins and losses are scored as
+    WIN less the number of plies until the game ends, so faster wins are
+    preferred.
+
+    Returns:
+        value: The exact value of the board, or None if it is not in the tablebase.
+    """
+    score = tablebase.probe(board)
+    if score is None:
+        return None
+    if score == 0:
+        return 0
+    value = WIN - distance_to_win(score)
+    if (score > 0) != (board.curr_player == player_number):
+        value = -value
+    return value
 
 
 class Node:
@@ -121,13 +149,16 @@ class Node:
         '''A winning board state has no children.'''
         return self.board.check_for_victory() is not None
     def children(self):
-        children_nodes = []
-        next_moves = self.board.get_move_list()
+        '''
+        Generate the child nodes, center columns first since those moves tend to be
+        best and so produce the most cutoffs.
+        '''
+        center = self.board.NCOL // 2
+        next_moves = sorted(self.board.get_move_list(), key=lambda move: abs(move - center))
         for next_move in next_moves:
             new_board = self.board.clone()
             new_board.make_move(next_move)
-            children_nodes.append(Node(new_board))
-        return children_nodes
+            yield Node(new_board)
 
 
 def other_player(player_num: int) -> int:
@@ -137,35 +168,42 @@ def other_player(player_num: int) -> int:
         return Board.P1
 
 
-def minimax(node, depth, is_maximizing_player, maximizing_player):
+def minimax(node, depth, is_maximizing_player, maximizing_player, evaluator=heuristic):
     '''
     Recursively explore all board states to a given depth.
     '''
     if depth == 0 or node.is_terminal():
-        return evaluate(node.board, maximizing_player)
+        return evaluate(node.board, maximizing_player, evaluator)
 
     ext_val = float('-inf') if is_maximizing_player else float('inf')
     ext_fn = max if is_maximizing_player else min
 
     for child in node.children():
-        val = minimax(child, depth - 1, not is_maximizing_player, maximizing_player)
+        val = minimax(child, depth - 1, not is_maximizing_player, maximizing_player, evaluator)
         ext_val = ext_fn(ext_val, val)
 
     return ext_val
 
 
-def alpha_beta(node, depth, alpha, beta, is_maximizing_player, maximizing_player):
+def alpha_beta(node, depth, alpha, beta, is_maximizing_player, maximizing_player, tablebase=None,
+               evaluator=heuristic):
     """
     Recursively explore all board states to a given depth, pruning using the alpha-beta
-    pruning algorithm.
+    pruning algorithm. Boards found in the tablebase, if one is given, are not searched
+    further.
     """
+    if tablebase is not None:
+        exact_val = evaluate_exact(node.board, maximizing_player, tablebase)
+        if exact_val is not None:
+            return exact_val
+
     if depth == 0 or node.is_terminal():
-        return evaluate(node.board, maximizing_player)
+        return evaluate(node.board, maximizing_player, evaluator)
     
     if is_maximizing_player:
         max_eval = float('-inf')
         for child in node.children():
-            eval = alpha_beta(child, depth - 1, alpha, beta, False, maximizing_player)
+            eval = alpha_beta(child, depth - 1, alpha, beta, False, maximizing_player, tablebase, evaluator)
             max_eval = max(eval, max_eval)
             alpha = max(eval, alpha)
             if beta <= alpha:
@@ -174,7 +212,7 @@ def alpha_beta(node, depth, alpha, beta, is_maximizing_player, maximizing_player
     else:
         min_eval = float('inf')
         for child in node.children():
-            eval = alpha_beta(child, depth - 1, alpha, beta, True, maximizing_player)
+            eval = alpha_beta(child, depth - 1, alpha, beta, True, maximizing_player, tablebase, evaluator)
             min_eval = min(eval, min_eval)
             beta = min(eval, beta)
             if beta <= alpha:
@@ -182,16 +220,198 @@ def alpha_beta(node, depth, alpha, beta, is_maximizing_player, maximizing_player
         return min_eval
 
 
+def principal_variation_search(node, depth, alpha, beta, is_maximizing_player, maximizing_player,
+                               tablebase=None, evaluator=heuristic):
+    """
+    Alpha-beta search that assumes the first child explored is the best one. The other
+    children are scouted with a null window, which only proves whether they are worse
+    than the first, and are searched again with the full window if not. Returns the same
+    value as alpha_beta.
+    """
+    if tablebase is not None:
+        exact_val = evaluate_exact(node.board, maximizing_player, tablebase)
+        if exact_val is not None:
+            return exact_val
+
+    if depth == 0 or node.is_terminal():
+        return evaluate(node.board, maximizing_player, evaluator)
+
+    is_first = True
+    if is_maximizing_player:
+        max_eval = float('-inf')
+        for child in node.children():
+            if is_first:
+                eval = principal_variation_search(
+                    child, depth - 1, alpha, beta, False, maximizing_player, tablebase, evaluator)
+                is_first = False
+            else:
+                eval = principal_variation_search(
+                    child, depth - 1, alpha, alpha + 1, False, maximizing_player, tablebase, evaluator)
+                if alpha < eval < beta:
+                    eval = principal_variation_search(
+                        child, depth - 1, alpha, beta, False, maximizing_player, tablebase, evaluator)
+            max_eval = max(eval, max_eval)
+            alpha = max(eval, alpha)
+            if beta <= alpha:
+                break
+        return max_eval
+    else:
+        min_eval = float('inf')
+        for child in node.children():
+            if is_first:
+                eval = principal_variation_search(
+                    child, depth - 1, alpha, beta, True, maximizing_player, tablebase, evaluator)
+                is_first = False
+            else:
+                eval = principal_variation_search(
+                    child, depth - 1, beta - 1, beta, True, maximizing_player, tablebase, evaluator)
+                if alpha < eval < beta:
+                    eval = principal_variation_search(
+                        child, depth - 1, alpha, beta, True, maximizing_player, tablebase, evaluator)
+            min_eval = min(eval, min_eval)
+            beta = min(eval, beta)
+            if beta <= alpha:
+                break
+        return min_eval
+
+
+class SearchCancelled(Exception):
+    '''Raised when a search is cancelled before it finishes.'''
+
+
+class SearchCache:
+    """
+    The results of the deepest search completed so far for each board, so that a
+    board can be searched ahead of time (e.g. by a Ponderer), or a search can pick
+    up where an earlier one left off. The least recently used boards are dropped
+    once max_size is reached. Safe to share between threads.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, board: Board):
+        """
+        Returns:
+            (depth, move, value): The deepest search result for the board, or None.
+        """
+        key = board.state.tobytes()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, board: Board, depth: int, move: int, value):
+        key = board.state.tobytes()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > depth:
+                return
+            self.entries[key] = (depth, move, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
 class AIPlayer(Player):
 
-    def __init__(self, player_num: int, max_depth: int):
+    def __init__(self, player_num: int, max_depth: int, tablebase: Tablebase | None = None,
+                 evaluator: Evaluator = heuristic, cache: SearchCache | None = None,
+                 tablebase_empty: int = 0):
+        """
+        Args:
+            tablebase_empty (int): Once a board with at most this many empty cells is
+                searched, a tablebase is generated from it (unless the player's tablebase
+                already covers it) and kept for the rest of the game.
+        """
         super().__init__(player_num)
         self.max_depth = max_depth
+        self.tablebase = tablebase
+        self.evaluator = evaluator
+        self.cache = cache
+        self.tablebase_empty = tablebase_empty
+
+    def update_tablebase(self, board: Board):
+        '''Generate a tablebase from the board if it is late enough in the game.'''
+        nempty = board.NROW * board.NCOL - np.count_nonzero(board.state)
+        if nempty > self.tablebase_empty:
+            return
+        if self.tablebase is None or self.tablebase.probe(board) is None:
+            self.tablebase = Tablebase.generate(board, self.tablebase_empty)
+
+    def get_move(self, board: Board, cancel: threading.Event | None = None, progress=None):
+        """
+        Search with increasing depth up to max_depth. Each iteration searches a narrow
+        window around the previous iteration's score, widening it if the score falls
+        outside, and tries the previous best move first.
+
+        If the player has a cache, a board already searched to max_depth is not searched
+        again, and one searched less deeply continues from the cached result.
+
+        Args:
+            board (Board): The current game board.
+            cancel (threading.Event): If given, the search raises SearchCancelled soon
+                after the event is set.
+            progress (callable): If given, called as progress(depth, move) with the best
+                move found each time a search depth is completed.
+        """
+        if not board.get_move_list():
+            return None
+
+        self.update_tablebase(board)
 
-    def get_move(self, board: Board):
-        
+        best_move = None
+        score = None
+        start_depth = 1
+        if self.cache is not None:
+            entry = self.cache.get(board)
+            if entry is not None:
+                depth, best_move, score = entry
+                if depth >= self.max_depth:
+                    if progress is not None:
+                        progress(depth, best_move)
+                    return best_move
+                start_depth = depth + 1
+
+        for depth in range(start_depth, self.max_depth + 1):
+            if score is None:
+                alpha, beta = float('-inf'), float('inf')
+            else:
+                alpha, beta = score - ASPIRATION_WINDOW, score + ASPIRATION_WINDOW
+            while True:
+                move, val = self.search_root(board, depth, alpha, beta, best_move, cancel)
+                if val <= alpha:
+                    alpha = float('-inf')
+                elif val >= beta:
+                    beta = float('inf')
+                else:
+                    break
+            best_move, score = move, val
+            if self.cache is not None:
+                self.cache.put(board, depth, best_move, score)
+            if progress is not None:
+                progress(depth, best_move)
+
+        return best_move
+
+    def search_root(self, board: Board, depth: int, alpha, beta, first_move=None, cancel=None):
+        """
+        Find the best move, given a search depth. The best value found so far is used as
+        the lower bound when searching the remaining moves.
+
+        Returns:
+            (move, value): The best move and its value. The value is only exact if it lies
+                between alpha and beta.
+        """
         moves = board.get_move_list()
-        best_move_val = -100000000
+        if first_move in moves:
+            moves.remove(first_move)
+            moves.insert(0, first_move)
+
+        best_move_val = alpha
         best_move = None
 
         def inherent_move_val(move):
@@ -200,21 +420,30 @@ class AIPlayer(Player):
             return min(move, board.NCOL - move - 1)
 
         for move in moves:
+            if cancel is not None and cancel.is_set():
+                raise SearchCancelled()
             temp = board.clone()
             temp.make_move(move)
             node = Node(temp)
-            # move_val = minimax(node, self.max_depth - 1, False, self.player_num)
-            move_val = alpha_beta(
-                node, 
-                self.max_depth - 1, 
-                float('-inf'), 
-                float('inf'),
+            # Ties go to the lowest column, so a lower column than the best move needs
+            # only to equal it
+            threshold = best_move_val - inherent_move_val(move)
+            if best_move is not None and move < best_move:
+                threshold -= 1
+            move_val = principal_variation_search(
+                node,
+                depth - 1,
+                threshold,
+                beta - inherent_move_val(move),
                 False,
-                self.player_num
+                self.player_num,
+                self.tablebase,
+                self.evaluator
             )
-            move_val += inherent_move_val(move)
-            if move_val > best_move_val:
-                best_move_val = move_val
+            if move_val > threshold:
+                best_move_val = move_val + inherent_move_val(move)
                 best_move = move
-        
-        return best_move
+                if best_move_val >= beta:
+                    break
+
+        return best_move, best_move_val
@@ -135,10 +135,6 @@ class Board(object):
             result: Player number for winning player, 0 if draw, or None if there is no winner yet.
         """
 
-        # Check for draw
-        if len(self.get_move_list()) == 0:
-            return self.EMPTY
-
         for cp in [self.P1, self.P2]:
 
             # check for vertical connections
@@ -199,4 +195,8 @@ class Board(object):
 
                     indx = (indx[0] + 1, indx[1] + 1)
 
+        # Check for draw
+        if len(self.get_move_list()) == 0:
+            return self.EMPTY
+
         return None
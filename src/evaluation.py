@@ -0,0 +1,157 @@
+# -*- coding: utf-8 *-*
+"""
+evaluation.py
+
+Board evaluation functions for the AI search. Any function or object that can
+be called as evaluator(board, player_number) and returns an int can be used,
+e.g. basic_ai.heuristic, or a PatternTableEvaluator loaded with trained weights.
+"""
+
+"""
+Copyright 2025 Michael Bell
+
+This file is part of connectfour.
+
+connectfour is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+connectfour is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with connectfour.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from typing import Protocol
+
+import numpy as np
+from src.board import Board
+
+
+class Evaluator(Protocol):
+    """
+    Scores a non-terminal board, with a positive number meaning the board is better
+    for the given player and a negative number meaning it is better for the opponent.
+
+    Scores must be integers, as the search relies on scores differing by at least 1
+    (e.g. in null window searches). Trained fractional weights should be scaled up
+    and rounded.
+    """
+    def __call__(self, board: Board, player_number: int) -> int:
+        ...
+
+
+class Cell:
+    '''Codes for the contents of a cell, from the point of view of one player.'''
+    VOID = 0    # An empty space that is not immediately fillable
+    GAP = 1     # An empty space that is immediately fillable
+    MINE = 2    # A space filled with the player's piece
+    THEIRS = 3  # A space filled with the opponent's piece
+
+
+NCODES = 4
+NPATTERNS = NCODES ** 4
+
+
+def find_windows() -> np.ndarray:
+    """
+    Find every set of 4 contiguous cells that could hold a winning sequence.
+
+    Returns:
+        windows: An array of shape (nwindows, 4) of flat indices into the board state.
+    """
+    windows = []
+    for row in range(Board.NROW):
+        for col in range(Board.NCOL):
+            for direction in [(1, 0), (0, 1), (1, 1), (1, -1)]:
+                cells = [(row + direction[0] * i, col + direction[1] * i) for i in range(4)]
+                if all(0 <= r < Board.NROW and 0 <= c < Board.NCOL for r, c in cells):
+                    windows.append([r * Board.NCOL + c for r, c in cells])
+    return np.array(windows)
+
+
+WINDOWS = find_windows()
+
+# Multiplying each cell code in a window by these and summing packs the window
+# into a pattern index
+PATTERN_PLACES = NCODES ** np.arange(4)
+
+# Offsets of each window's scores in a flattened per-window pattern table
+WINDOW_OFFSETS = np.arange(len(WINDOWS)) * NPATTERNS
+
+
+def pattern_cells(pattern: int) -> list[int]:
+    '''The cell codes packed into a pattern index.'''
+    return [(pattern // NCODES ** i) % NCODES for i in range(4)]
+
+
+def default_pattern_table() -> np.ndarray:
+    """
+    The pattern scores used by basic_ai.heuristic: for a window with no opposing
+    pieces,
+
+    - +5 for 2 pieces
+    - +20 for 3 pieces, with the empty spot not yet reachable
+    - +50 for 3 pieces, with the empty spot reachable
+
+    and the negative of these for the opponent's windows.
+    """
+    table = np.zeros(NPATTERNS, dtype=int)
+    for pattern in range(NPATTERNS):
+        cells = pattern_cells(pattern)
+        for piece, other_piece, modifier in [(Cell.MINE, Cell.THEIRS, 1), (Cell.THEIRS, Cell.MINE, -1)]:
+            if other_piece in cells:
+                continue
+            npieces = cells.count(piece)
+            if npieces == 2:
+                table[pattern] += modifier * 5
+            elif npieces == 3 and Cell.VOID in cells:
+                table[pattern] += modifier * 20
+            elif npieces == 3:
+                table[pattern] += modifier * 50
+    return table
+
+
+class PatternTableEvaluator:
+    """
+    Evaluates a board as the sum of a score for each window of 4 cells, looked up
+    from the pattern of cell codes in the window. The table can either hold one
+    score per pattern, shared by all windows, or a separate score per window and
+    pattern, of shape (len(WINDOWS), NPATTERNS). Scores must be integers (see
+    Evaluator).
+    """
+
+    def __init__(self, table: np.ndarray | None = None):
+        if table is None:
+            table = default_pattern_table()
+        table = np.asarray(table)
+        if table.shape not in [(NPATTERNS,), (len(WINDOWS), NPATTERNS)]:
+            raise ValueError(f"Invalid pattern table shape {table.shape}")
+        if not np.issubdtype(table.dtype, np.integer):
+            raise ValueError(f"Pattern table must hold integers, not {table.dtype}")
+        self.table = np.array(np.broadcast_to(table, (len(WINDOWS), NPATTERNS)))
+        self.flat_table = self.table.ravel()
+
+    @classmethod
+    def load(cls, path: str) -> 'PatternTableEvaluator':
+        '''Load a pattern table saved with save, or with numpy.save.'''
+        return cls(np.load(path))
+
+    def save(self, path: str):
+        np.save(path, self.table)
+
+    def __call__(self, board: Board, player_number: int) -> int:
+        state = board.state
+        empty = state == board.EMPTY
+        # An empty cell is fillable if it is on the bottom row, or above a piece
+        fillable = empty.copy()
+        fillable[:-1] &= ~empty[1:]
+        codes = np.where(state == player_number, Cell.MINE, Cell.THEIRS)
+        codes[empty] = Cell.VOID
+        codes[fillable] = Cell.GAP
+        patterns = codes.ravel()[WINDOWS] @ PATTERN_PLACES
+        return int(self.flat_table[WINDOW_OFFSETS + patterns].sum())
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 *-*
+"""
+ponder.py
+
+Pondering, i.e. searching on the opponent's time. While the opponent decides on
+a move, the AI searches its responses to the opponent's likely replies, so that
+when the opponent does move the AI's answer is often already in its cache.
+"""
+
+"""
+Copyright 2025 Michael Bell
+
+This file is part of connectfour.
+
+connectfour is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+connectfour is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with connectfour.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import threading
+
+from src.board import Board
+from src.basic_ai import AIPlayer, SearchCache, SearchCancelled, evaluate
+
+
+def likely_replies(board: Board, evaluator) -> list[int]:
+    """
+    The legal moves for the player to move, most promising first according to
+    a one ply evaluation from that player's point of view.
+    """
+    def reply_val(move):
+        temp = board.clone()
+        temp.make_move(move)
+        return evaluate(temp, board.curr_player, evaluator)
+
+    return sorted(board.get_move_list(), key=reply_val, reverse=True)
+
+
+class Ponderer:
+    """
+    Runs an AIPlayer's searches in a background thread while its opponent is
+    thinking. The results go into the player's cache (one is created if the
+    player has none), so the player's next get_move returns immediately if the
+    opponent's reply was searched, and the cache size bounds the memory used.
+    """
+
+    def __init__(self, player: AIPlayer):
+        if player.cache is None:
+            player.cache = SearchCache()
+        self.player = player
+        self.thread = None
+        self.cancel = None
+
+    def start(self, board: Board):
+        """
+        Start pondering, given the board with the opponent to move. Any pondering
+        already in progress is stopped.
+        """
+        self.stop()
+        self.cancel = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(board.clone(), self.cancel), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''Cancel pondering and wait for the background search to finish.'''
+        if self.thread is not None:
+            self.cancel.set()
+            self.thread.join()
+            self.thread = None
+
+    def run(self, board: Board, cancel: threading.Event):
+        try:
+            for reply in likely_replies(board, self.player.evaluator):
+                temp = board.clone()
+                temp.make_move(reply)
+                if temp.check_for_victory() is None:
+                    self.player.get_move(temp, cancel)
+        except SearchCancelled:
+            pass
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 *-*
+"""
+tablebase.py
+
+Endgame tablebases for connect four. A tablebase stores the exact game
+theoretic result of every position reachable from some root position that has
+at most a given number of empty cells, so that late game search can look up
+the result instead of relying on the heuristic.
+"""
+
+"""
+Copyright 2025 Michael Bell
+
+This file is part of connectfour.
+
+connectfour is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+connectfour is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with connectfour.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from src.board import Board
+
+
+# Positions are packed into bitboards with one column per H bits, the extra
+# bit above the top row keeping columns from running into each other.
+H = Board.NROW + 1
+NCELLS = Board.NROW * Board.NCOL
+
+# Scores are from the point of view of the player to move: MAX_SCORE - n for a
+# win in n plies, -(MAX_SCORE - n) for a loss in n plies and 0 for a draw.
+MAX_SCORE = NCELLS + 1
+
+
+def bottom_mask(col: int) -> int:
+    return 1 << (col * H)
+
+
+def top_mask(col: int) -> int:
+    return 1 << (col * H + Board.NROW - 1)
+
+
+def to_bitboard(board: Board) -> tuple[int, int]:
+    """
+    Convert a board to a bitboard pair.
+
+    Returns:
+        (p1, mask): Bits set for the cells holding player 1's pieces, and for
+            all non-empty cells.
+    """
+    p1 = 0
+    mask = 0
+    for col in range(board.NCOL):
+        for row in range(board.NROW):
+            val = board.state[board.NROW - 1 - row, col]
+            if val == board.EMPTY:
+                break
+            bit = 1 << (col * H + row)
+            mask |= bit
+            if val == board.P1:
+                p1 |= bit
+    return p1, mask
+
+
+def bitboard_key(p1: int, mask: int) -> int:
+    """
+    A unique integer for a position. Within each column p1 is smaller than
+    the filled part of mask, so adding them never carries into the next column.
+    """
+    return p1 + mask
+
+
+def has_four(bits: int) -> bool:
+    for shift in (1, H, H - 1, H + 1):
+        m = bits & (bits >> shift)
+        if m & (m >> (2 * shift)):
+            return True
+    return False
+
+
+def distance_to_win(score: int) -> int:
+    """The number of plies until the game ends for a non-drawn score."""
+    return MAX_SCORE - abs(score)
+
+
+def children(p1: int, mask: int, p1_to_move: bool):
+    """Yield the bitboard pairs of the positions after each legal move."""
+    for col in range(Board.NCOL):
+        if mask & top_mask(col):
+            continue
+        new_mask = mask | (mask + bottom_mask(col))
+        yield (p1 | (new_mask ^ mask) if p1_to_move else p1), new_mask
+
+
+def is_game_over(p1: int, mask: int, p1_to_move: bool) -> bool:
+    """Whether the player who just moved has connected four."""
+    return has_four(p1 ^ mask if p1_to_move else p1)
+
+
+def solve_layers(root: Board, max_empty: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Exactly solve every position reachable from root with at most max_empty
+    empty cells.
+
+    All reachable positions are enumerated one ply at a time, then solved
+    backwards starting from the full board, each layer being scored from the
+    layer below it.
+
+    Returns:
+        keys, scores: Sorted position keys (see bitboard_key) and their scores.
+    """
+    p1, mask = to_bitboard(root)
+    root_nmoves = bin(mask).count('1')
+    layers = [{(p1, mask)}]
+    while root_nmoves + len(layers) - 1 < NCELLS:
+        p1_to_move = (root_nmoves + len(layers) - 1) % 2 == 0
+        next_layer = set()
+        for p1, mask in layers[-1]:
+            if not is_game_over(p1, mask, p1_to_move):
+                next_layer.update(children(p1, mask, p1_to_move))
+        if not next_layer:
+            break
+        layers.append(next_layer)
+
+    scores = {}
+    for i in range(len(layers) - 1, -1, -1):
+        nmoves = root_nmoves + i
+        if NCELLS - nmoves > max_empty:
+            break
+        p1_to_move = nmoves % 2 == 0
+        for p1, mask in layers[i]:
+            key = bitboard_key(p1, mask)
+            if is_game_over(p1, mask, p1_to_move):
+                scores[key] = -MAX_SCORE
+                continue
+            # A full board with no winner is a draw
+            best = 0 if nmoves == NCELLS else -MAX_SCORE
+            for child in children(p1, mask, p1_to_move):
+                # Negate the child's score and move it one ply further out
+                val = -scores[bitboard_key(*child)]
+                val += (val < 0) - (val > 0)
+                best = max(best, val)
+            scores[key] = best
+
+    keys = np.array(sorted(scores), dtype=np.uint64)
+    values = np.array([scores[int(k)] for k in keys], dtype=np.int8)
+    return keys, values
+
+
+class Tablebase:
+    """
+    A table of exact scores for endgame positions, stored as a sorted array of
+    position keys alongside an array of scores.
+    """
+
+    def __init__(self, keys: np.ndarray, scores: np.ndarray, max_empty: int):
+        self.keys = keys
+        self.scores = scores
+        self.max_empty = max_empty
+
+    @classmethod
+    def generate(cls, root: Board, max_empty: int) -> 'Tablebase':
+        """
+        Build a tablebase of all positions reachable from root with at most
+        max_empty empty cells. The number of positions grows very quickly with
+        the number of empty cells in root, so root should be a late game
+        position.
+        """
+        keys, scores = solve_layers(root, max_empty)
+        return cls(keys, scores, max_empty)
+
+    @classmethod
+    def load(cls, path: str) -> 'Tablebase':
+        with np.load(path) as data:
+            return cls(data['keys'], data['scores'], int(data['max_empty']))
+
+    def save(self, path: str):
+        np.savez_compressed(path, keys=self.keys, scores=self.scores, max_empty=self.max_empty)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def probe(self, board: Board) -> int | None:
+        """
+        Look up the score of a position, from the point of view of the player
+        to move.
+
+        Returns:
+            score: The score, or None if the position is not in the tablebase.
+        """
+        if NCELLS - np.count_nonzero(board.state) > self.max_empty:
+            return None
+        key = np.uint64(bitboard_key(*to_bitboard(board)))
+        i = np.searchsorted(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return int(self.scores[i])
+        return None
@@ -130,25 +130,61 @@ window.startGame = function(boardData, p1Type, p2Type) {
         });
     }
 
-    function maybeAIMove() {
+    function handleAIMove(data) {
+        if (data.error) {
+            statusDiv.textContent = data.error;
+            return;
+        }
+        if (data.board) {
+            board = data.board;
+            hoverCol = null;
+            render();
+        }
+        if (data.winner !== null) {
+            gameOver = true;
+            if (data.winner === 0) {
+                statusDiv.textContent = "It's a draw!";
+            } else {
+                statusDiv.textContent = `Player ${data.winner} wins!`;
+            }
+        } else {
+            statusDiv.textContent = `Player ${board.curr_player}'s turn`;
+            if (isAITurn()) maybeAIMove();
+        }
+    }
+
+    function postAIMove() {
         fetch('/ai_move', { method: 'POST' })
         .then(r => r.json())
-        .then(data => {
-            if (data.board) {
-                board = data.board;
-                hoverCol = null;
-                render();
-            }
-            if (data.winner !== null) {
-                gameOver = true;
-                if (data.winner === 0) {
-                    statusDiv.textContent = "It's a draw!";
-                } else {
-                    statusDiv.textContent = `Player ${data.winner} wins!`;
-                }
+        .then(handleAIMove)
+        .catch(error => {
+            console.error('Error making AI move:', error);
+            statusDiv.textContent = 'Error making AI move: ' + error.message;
+        });
+    }
+
+    function maybeAIMove() {
+        if (!window.EventSource) {
+            postAIMove();
+            return;
+        }
+        // Stream the AI's best move as its search deepens
+        const source = new EventSource('/ai_move_stream');
+        source.addEventListener('progress', e => {
+            const data = JSON.parse(e.data);
+            statusDiv.textContent = `Player ${board.curr_player} is thinking... (depth ${data.depth}: column ${data.move})`;
+        });
+        source.addEventListener('move', e => {
+            source.close();
+            handleAIMove(JSON.parse(e.data));
+        });
+        source.addEventListener('error', e => {
+            source.close();
+            if (e.data) {
+                statusDiv.textContent = JSON.parse(e.data).error;
             } else {
-                statusDiv.textContent = `Player ${board.curr_player}'s turn`;
-                if (isAITurn()) maybeAIMove();
+                // The stream could not be opened or was dropped
+                postAIMove();
             }
         });
     }
@@ -1,8 +1,17 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, session, redirect, url_for
 from src.board import Board
 from src.player import RandomPlayer
-from src.basic_ai import AIPlayer
+from src.basic_ai import AIPlayer, SearchCancelled, heuristic
+from src.evaluation import PatternTableEvaluator
+from src.ponder import likely_replies
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import numpy as np
+import threading
+import queue
+import json
+import uuid
 import os
 
 app = Flask(__name__)
@@ -16,6 +25,53 @@ PLAYER_TYPES = {
 
 AI_DEPTH = 5
 
+# Late in the game the AI solves the game exactly, from a tablebase generated
+# once there are this many empty cells left
+AI_TABLEBASE_EMPTY = 14
+
+# Trained pattern table weights for the AI evaluation, if any
+AI_WEIGHTS = os.environ.get('CONNECTFOUR_AI_WEIGHTS')
+AI_EVALUATOR = PatternTableEvaluator.load(AI_WEIGHTS) if AI_WEIGHTS else heuristic
+
+# Games are kept server side so that a streamed AI move can be committed
+# after the response headers (and the session cookie) have been sent. The
+# session only carries the game id. The oldest games are dropped once
+# MAX_GAMES is reached to keep memory bounded.
+MAX_GAMES = 10000
+GAMES = OrderedDict()
+GAMES_LOCK = threading.Lock()
+
+# While a human is choosing a move, the AI's replies to the human's most
+# likely moves are searched ahead of time, in their own pool. Searches for
+# replies the human didn't make are cancelled.
+MAX_PONDER_REPLIES = 3
+PONDER_WORKERS = max(1, os.cpu_count() // 4)
+
+def lower_priority():
+    '''Run a ponder worker at a lower priority than the AI_EXECUTOR workers.'''
+    if hasattr(os, 'nice'):
+        os.nice(10)
+
+# AI search is CPU bound, so it runs in worker processes rather than in the
+# request threads, where it would hold the GIL and stall every other game.
+# The two pools share the cores between them, and as the ponder workers run at
+# a lower priority, searches players are waiting on take precedence when there
+# are too few cores for both (e.g. on a single core machine).
+AI_EXECUTOR = ProcessPoolExecutor(max_workers=max(1, os.cpu_count() - PONDER_WORKERS))
+PONDER_EXECUTOR = ProcessPoolExecutor(max_workers=PONDER_WORKERS, initializer=lower_priority)
+
+# Shares queues and events between the web server and the worker processes. Started the
+# first time it is needed.
+MANAGER = None
+MANAGER_LOCK = threading.Lock()
+
+def get_manager():
+    global MANAGER
+    with MANAGER_LOCK:
+        if MANAGER is None:
+            MANAGER = multiprocessing.Manager()
+        return MANAGER
+
 # Helper to serialize the board state for the frontend
 def board_to_dict(board):
     return {
@@ -25,6 +81,125 @@ def board_to_dict(board):
         'ncol': board.NCOL
     }
 
+def get_game():
+    with GAMES_LOCK:
+        game = GAMES.get(session.get('game_id'))
+        if game is not None:
+            GAMES.move_to_end(session['game_id'])
+        return game
+
+def load_board(game):
+    board = Board()
+    board.state = np.array(game['board'])
+    board.curr_player = game['curr_player']
+    return board
+
+def save_board(game, board, expected_state):
+    """
+    Store the board in the game, unless the game has moved on since
+    expected_state was loaded (e.g. a duplicate request for the same turn).
+
+    Returns:
+        bool: Whether the board was stored.
+    """
+    with GAMES_LOCK:
+        if game['board'] != expected_state:
+            return False
+        game['board'] = board.state.tolist()
+        game['curr_player'] = board.curr_player
+        return True
+
+def search_move(state, curr_player, depth, progress_queue=None, cancel=None):
+    """
+    Run an AI search in a worker process. If a progress queue is given, a
+    (depth, move) pair is put on it each time a search depth is completed.
+    If a cancel event is given, the search raises SearchCancelled soon after
+    it is set.
+    """
+    board = Board(np.array(state))
+    player = AIPlayer(curr_player, depth, evaluator=AI_EVALUATOR, tablebase_empty=AI_TABLEBASE_EMPTY)
+    progress = None
+    if progress_queue is not None:
+        progress = lambda done_depth, move: progress_queue.put((done_depth, int(move)))
+    return player.get_move(board, cancel=cancel, progress=progress)
+
+def player_type(game, player_num):
+    return game['p1_type'] if player_num == Board.P1 else game['p2_type']
+
+def cancel_ponder(ponder):
+    '''Cancel pondered searches, given as a dict of (future, cancel event).'''
+    for future, cancel in ponder.values():
+        if not future.cancel():
+            cancel.set()
+
+def update_ponder(game, board):
+    """
+    Cancel any pondering for the game other than for the current board, and
+    if a human is now to move against the AI, start searching the AI's reply
+    to each of the human's most likely moves.
+    """
+    key = board.state.tobytes()
+    with GAMES_LOCK:
+        ponder = game.pop('ponder', {})
+        if key in ponder:
+            game['ponder'] = {key: ponder.pop(key)}
+    cancel_ponder(ponder)
+
+    if board.check_for_victory() is not None:
+        return
+    ai_player = Board.P2 if board.curr_player == Board.P1 else Board.P1
+    if player_type(game, board.curr_player) != 'human' or player_type(game, ai_player) != 'ai':
+        return
+    ponder = {}
+    for col in likely_replies(board, AI_EVALUATOR)[:MAX_PONDER_REPLIES]:
+        temp = board.clone()
+        temp.make_move(col)
+        if temp.check_for_victory() is None:
+            cancel = get_manager().Event()
+            future = PONDER_EXECUTOR.submit(
+                search_move, temp.state.tolist(), ai_player, game['ai_depth'], None, cancel)
+            ponder[temp.state.tobytes()] = (future, cancel)
+    with GAMES_LOCK:
+        game['ponder'] = ponder
+
+def pondered_move(game, board):
+    """
+    Returns:
+        int: The AI's move for the board if it was pondered, or None.
+    """
+    with GAMES_LOCK:
+        future, _ = game.get('ponder', {}).pop(board.state.tobytes(), (None, None))
+    # A search that has not started yet is cancelled and run normally instead
+    if future is None or future.cancel():
+        return None
+    try:
+        return future.result()
+    except SearchCancelled:
+        return None
+
+def is_computer_turn(game, board):
+    '''Whether the game is still going, with an AI or random player to move.'''
+    return (player_type(game, board.curr_player) in ('ai', 'random')
+            and board.check_for_victory() is None)
+
+def computer_move(game, board):
+    if player_type(game, board.curr_player) == 'ai':
+        move = pondered_move(game, board)
+        if move is not None:
+            return move
+        future = AI_EXECUTOR.submit(search_move, game['board'], board.curr_player, game['ai_depth'])
+        return future.result()
+    elif player_type(game, board.curr_player) == 'random':
+        return RandomPlayer(board.curr_player).get_move(board)
+    raise ValueError("Not a computer player's turn")
+
+def move_response(game, board, expected_state):
+    if not save_board(game, board, expected_state):
+        return jsonify({'error': 'Game state changed, please retry'}), 409
+    update_ponder(game, board)
+    winner = board.check_for_victory()
+    return jsonify({'board': board_to_dict(board), 'winner': winner})
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -34,65 +209,118 @@ def new_game():
     p1 = request.form.get('p1')
     p2 = request.form.get('p2')
     board = Board()
-    session['board'] = board.state.tolist()
-    session['curr_player'] = board.curr_player
-    session['p1_type'] = p1
-    session['p2_type'] = p2
-    session['ai_depth'] = AI_DEPTH
+    game_id = uuid.uuid4().hex
+    stale_ponders = []
+    with GAMES_LOCK:
+        # The session's previous game is abandoned
+        if session.get('game_id') in GAMES:
+            stale_ponders.append(GAMES.pop(session['game_id']).pop('ponder', {}))
+        GAMES[game_id] = {
+            'board': board.state.tolist(),
+            'curr_player': board.curr_player,
+            'p1_type': p1,
+            'p2_type': p2,
+            'ai_depth': AI_DEPTH,
+        }
+        while len(GAMES) > MAX_GAMES:
+            stale_ponders.append(GAMES.popitem(last=False)[1].pop('ponder', {}))
+    for ponder in stale_ponders:
+        cancel_ponder(ponder)
+    session['game_id'] = game_id
     return redirect(url_for('game'))
 
 @app.route('/game')
 def game():
-    board = Board()
-    board.state = np.array(session['board'])
-    board.curr_player = session['curr_player']
+    game = get_game()
+    if game is None:
+        return redirect(url_for('index'))
+    board = load_board(game)
     # Pass player types to the template
-    p1_type = session.get('p1_type', 'human')
-    p2_type = session.get('p2_type', 'human')
+    p1_type = game.get('p1_type', 'human')
+    p2_type = game.get('p2_type', 'human')
     return render_template('game.html', board=board_to_dict(board), p1_type=p1_type, p2_type=p2_type)
 
 @app.route('/move', methods=['POST'])
 def move():
+    game = get_game()
+    if game is None:
+        return jsonify({'error': 'No game in progress'}), 404
     col = int(request.json['col'])
-    board = Board()
-    board.state = np.array(session['board'])
-    board.curr_player = session['curr_player']
-    curr_player = board.curr_player
-    ptype = session['p1_type'] if curr_player == Board.P1 else session['p2_type']
-    if ptype == 'human':
+    board = load_board(game)
+    expected_state = board.state.tolist()
+    if player_type(game, board.curr_player) == 'human':
         if not board.is_legal_move(col):
             return jsonify({'error': 'Illegal move'}), 400
         board.make_move(col)
-    else:
+    elif is_computer_turn(game, board):
         # AI or random
-        if ptype == 'ai':
-            player = AIPlayer(curr_player, session['ai_depth'])
-        else:
-            player = RandomPlayer(curr_player)
-        move = player.get_move(board)
-        board.make_move(move)
-    session['board'] = board.state.tolist()
-    session['curr_player'] = board.curr_player
-    winner = board.check_for_victory()
-    return jsonify({'board': board_to_dict(board), 'winner': winner})
+        board.make_move(computer_move(game, board))
+    else:
+        return jsonify({'error': 'Game state changed, please retry'}), 409
+    return move_response(game, board, expected_state)
 
 @app.route('/ai_move', methods=['POST'])
 def ai_move():
-    board = Board()
-    board.state = np.array(session['board'])
-    board.curr_player = session['curr_player']
-    curr_player = board.curr_player
-    ptype = session['p1_type'] if curr_player == Board.P1 else session['p2_type']
-    if ptype == 'ai':
-        player = AIPlayer(curr_player, session['ai_depth'])
-    else:
-        player = RandomPlayer(curr_player)
-    move = player.get_move(board)
-    board.make_move(move)
-    session['board'] = board.state.tolist()
-    session['curr_player'] = board.curr_player
-    winner = board.check_for_victory()
-    return jsonify({'board': board_to_dict(board), 'winner': winner})
+    game = get_game()
+    if game is None:
+        return jsonify({'error': 'No game in progress'}), 404
+    board = load_board(game)
+    expected_state = board.state.tolist()
+    # e.g. a retried request for a move that has already been made
+    if not is_computer_turn(game, board):
+        return jsonify({'error': 'Game state changed, please retry'}), 409
+    board.make_move(computer_move(game, board))
+    return move_response(game, board, expected_state)
+
+@app.route('/ai_move_stream')
+def ai_move_stream():
+    """
+    Server-sent events version of /ai_move. The AI searches with increasing
+    depth, and a 'progress' event with the current best move is sent after
+    each depth. A final 'move' event carries the new board, as /ai_move does.
+    """
+    game = get_game()
+    if game is None:
+        return jsonify({'error': 'No game in progress'}), 404
+    board = load_board(game)
+    expected_state = board.state.tolist()
+    ptype = player_type(game, board.curr_player)
+
+    def event(name, data):
+        return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+    def generate():
+        # e.g. a retried request for a move that has already been made
+        if not is_computer_turn(game, board):
+            yield event('error', {'error': 'Game state changed, please retry'})
+            return
+        move = pondered_move(game, board) if ptype == 'ai' else None
+        if move is not None:
+            yield event('progress', {'depth': game['ai_depth'], 'move': int(move)})
+        elif ptype == 'ai':
+            progress_queue = get_manager().Queue()
+            future = AI_EXECUTOR.submit(
+                search_move, expected_state, board.curr_player, game['ai_depth'], progress_queue)
+            while True:
+                try:
+                    depth, best_move = progress_queue.get(timeout=0.1)
+                except queue.Empty:
+                    # Every progress update is queued before the search returns
+                    if future.done() and progress_queue.empty():
+                        break
+                    continue
+                yield event('progress', {'depth': depth, 'move': best_move})
+            move = future.result()
+        else:
+            move = computer_move(game, board)
+        board.make_move(move)
+        if not save_board(game, board, expected_state):
+            yield event('error', {'error': 'Game state changed, please retry'})
+            return
+        update_ponder(game, board)
+        yield event('move', {'board': board_to_dict(board), 'winner': board.check_for_victory()})
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    app.run(debug=True, threaded=True)